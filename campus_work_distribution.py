@@ -1,11 +1,16 @@
+import os
+import json
+import contextlib
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
 import geopandas as gpd
 import pydeck as pdk
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from io import BytesIO
-import base64
+import shapely
 
 # Configuration 
 
@@ -24,6 +29,22 @@ CRAFT_COLORS = {
     "PROJECT MANAGEMENT":"#7f7f7f",
     # add any others here
 }
+CRAFT_CATS = list(CRAFT_COLORS)
+COLOR_ARR  = np.array(list(CRAFT_COLORS.values()))
+# legend swatch markup, index-aligned with COLOR_ARR
+SWATCH_HTML = np.array([
+    f"<span style='display:inline-block;"
+    f"width:12px; height:12px; background:{c};"
+    f"margin-right:4px; vertical-align:middle'></span>"
+    for c in COLOR_ARR
+], dtype=object)
+# building fill per COLOR_ARR entry, then one row at NO_DATA_FILL for
+# buildings without work orders (the old uniform blue)
+NO_DATA_FILL = len(COLOR_ARR)
+FILL_RGBA = np.array(
+    [[int(c[i:i + 2], 16) for i in (1, 3, 5)] + [140] for c in COLOR_ARR]
+    + [[50, 100, 200, 80]]
+)
 
 SEASON_MONTHS = {
     "Winter": [12, 1, 2],
@@ -32,6 +53,93 @@ SEASON_MONTHS = {
     "Fall":   [9, 10, 11],
 }
 PCT_ON_SLICE = 5.0
+WO_PATH = "DF_WO_GaTech.csv"
+# stamped into the Parquet cache; bump the version whenever convert_csv
+# changes what it writes. The palette is part of it because CRAFT's
+# category order is baked into the file
+WO_LAYOUT = json.dumps({"version": 5, "crafts": CRAFT_CATS}).encode()
+
+
+# Load Work-Orders 
+
+def normalize_names(s):
+    # upper-case + trim as Arrow kernels over one buffer; nulls stay null
+    arr = pc.utf8_trim_whitespace(pc.utf8_upper(pa.array(s, type=pa.large_string())))
+    return pd.Series(pd.arrays.ArrowStringArray(arr), index=s.index)
+
+def parquet_is_current(pq_path, csv_path):
+    # stale if missing, older than the CSV, unreadable, or written by
+    # another layout
+    if (not os.path.exists(pq_path)
+            or os.path.getmtime(pq_path) < os.path.getmtime(csv_path)):
+        return False
+    try:
+        meta = pq.read_schema(pq_path).metadata or {}
+    except (pa.ArrowInvalid, OSError):
+        return False
+    return meta.get(b"wo_layout") == WO_LAYOUT
+
+def convert_csv(path):
+    # CSV -> stamped table with the derived columns, so loading the cache is
+    # a plain column read. Arrow's multi-threaded reader projects the three
+    # columns while scanning and parses the dd-Mon-yy dates natively
+    raw = pacsv.read_csv(
+        path,
+        convert_options=pacsv.ConvertOptions(
+            include_columns=["WORKDATE", "FAC_ID", "CRAFT"],
+            column_types={
+                "WORKDATE": pa.timestamp("s"),
+                "FAC_ID":   pa.dictionary(pa.int32(), pa.string()),
+                "CRAFT":    pa.dictionary(pa.int32(), pa.string()),
+            },
+            timestamp_parsers=["%d-%b-%y"],
+        ),
+    )
+    # a blank WORKDATE reads as null: it can never pass the year filter and
+    # would break the integer year/month casts, so the row is dropped here
+    df = raw.filter(pc.is_valid(raw["WORKDATE"])).to_pandas()
+    workdate = df.pop("WORKDATE").dt
+    df["year"]   = workdate.year.astype(np.int16)
+    df["month"]  = workdate.month.astype(np.int8)
+    # normalise the distinct ids only, then remap the codes; spellings
+    # that collapse to the same id share one category
+    fac   = df["FAC_ID"]
+    norm  = normalize_names(fac.cat.categories.to_series()).to_numpy()
+    uniq, remap = np.unique(norm, return_inverse=True)
+    codes = fac.cat.codes.to_numpy()
+    df["FAC_ID"] = pd.Categorical.from_codes(
+        np.where(codes < 0, -1, remap[codes]), categories=uniq
+    )
+    extra = sorted(set(df["CRAFT"].cat.categories) - set(CRAFT_COLORS))
+    df["CRAFT"] = df["CRAFT"].cat.set_categories(CRAFT_CATS + extra)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.replace_schema_metadata(
+        {**table.schema.metadata, b"wo_layout": WO_LAYOUT}
+    )
+
+def write_parquet(table, pq_path):
+    # write beside the target and rename over it, so a conversion that dies
+    # half-way never leaves a truncated cache behind
+    tmp_path = f"{pq_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, pq_path)
+    except OSError:
+        # read-only deploy: no cache, every cold start converts the CSV
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+@st.cache_resource
+def load_raw(path):
+    # shared by reference across reruns and sessions: callers must not mutate
+    pq_path = os.path.splitext(path)[0] + ".parquet"
+    if parquet_is_current(pq_path, path):
+        return pd.read_parquet(pq_path, engine="pyarrow")
+    # one-time conversion, redone whenever the cache is stale; the frame
+    # comes from the converted table, so a failed write costs nothing now
+    table = convert_csv(path)
+    write_parquet(table, pq_path)
+    return table.to_pandas()
 
 
 # Sidebar Filters 
@@ -39,25 +147,23 @@ PCT_ON_SLICE = 5.0
 st.sidebar.header("🔍 Filters")
 
 @st.cache_data
-def load_years():
-    tmp = pd.read_csv(
-        "DF_WO_GaTech.csv",
-        parse_dates=["WORKDATE"],
-        usecols=["WORKDATE"]
+def load_workdate_stats():
+    df = load_raw(WO_PATH)
+    return (
+        int(df["year"].min()), int(df["year"].max()),
+        int(df["month"].min()), int(df["month"].max()),
     )
-    yrs = tmp["WORKDATE"].dt.year
-    return int(yrs.min()), int(yrs.max())
 
-min_year, max_year = load_years()
+min_year, max_year, min_month, max_month = load_workdate_stats()
 selected_years = st.sidebar.slider(
     "Year range", min_year, max_year, (min_year, max_year)
 )
 
 filter_months = st.sidebar.checkbox("Filter by month-range", False)
 if filter_months:
-    tmp = pd.read_csv("DF_WO_GaTech.csv", parse_dates=["WORKDATE"], usecols=["WORKDATE"])
-    mn, mx = tmp["WORKDATE"].dt.month.min(), tmp["WORKDATE"].dt.month.max()
-    selected_months = st.sidebar.slider("Month range", int(mn), int(mx), (int(mn), int(mx)))
+    selected_months = st.sidebar.slider(
+        "Month range", min_month, max_month, (min_month, max_month)
+    )
 else:
     selected_months = (None, None)
 
@@ -69,117 +175,189 @@ else:
     season_months = None
 
 
-# Load & Filter Work-Orders 
+# Filter Work-Orders 
 
-@st.cache_data
 def load_and_filter_orders(years, months, season):
-    df = pd.read_csv("DF_WO_GaTech.csv", parse_dates=["WORKDATE"])
-    df["year"]   = df["WORKDATE"].dt.year
-    df["month"]  = df["WORKDATE"].dt.month
-    df["FAC_ID"] = df["FAC_ID"].str.upper().str.strip()
+    df = load_raw(WO_PATH)
+
+    yr = df["year"].to_numpy()
+    mo = df["month"].to_numpy()
 
-    mask = df["year"].between(*years)
+    mask = (yr >= years[0]) & (yr <= years[1])
     if months[0] is not None:
-        mask &= df["month"].between(*months)
+        mask &= (mo >= months[0]) & (mo <= months[1])
     if season is not None:
-        mask &= df["month"].isin(season)
+        # month-set membership as one shift+and; int16 so 1 << 12 fits
+        bits = sum(1 << m for m in season)
+        mask &= ((np.int16(1) << mo) & bits) != 0
 
-    return df.loc[mask]
-
-df = load_and_filter_orders(selected_years, selected_months, season_months)
+    # only the rows that pass, and only the columns the aggregation reads
+    return df.loc[mask, ["FAC_ID", "CRAFT"]]
 
 
 # Load Building Footprints
 
-@st.cache_data
+@st.cache_resource
 def load_buildings():
-    gdf = gpd.read_file("campus_buildings.geojson")
-    gdf["Sheet3__Common_Name"] = (
-        gdf["Sheet3__Common_Name"].str.upper().str.strip()
+    # shared by reference (no per-rerun unpickling of the geometries):
+    # callers must not mutate it, derive new frames with join/assign instead
+    gdf = gpd.read_file(
+        "campus_buildings.geojson",
+        engine="pyogrio",
+        use_arrow=True,
+        columns=["Sheet3__Common_Name"],
+    )
+    gdf["Sheet3__Common_Name"] = normalize_names(gdf["Sheet3__Common_Name"])
+    # ~0.1 m is plenty for a campus map and trims every coordinate in the
+    # JSON sent to the browser from 15+ digits to 6 decimals
+    gdf["geometry"] = gpd.GeoSeries(
+        shapely.transform(gdf.geometry.to_numpy(), lambda c: c.round(6)),
+        index=gdf.index,
+        crs=gdf.crs,
     )
     return gdf
 
-gdf = load_buildings()
-
 
 # Aggregate by Craft 
 
-grouped = (
-    df.groupby("FAC_ID")["CRAFT"]
-      .value_counts()
-      .unstack(fill_value=0)
-)
+@st.cache_data
+def compute_grouped(years, months, season):
+    # only the small FAC_ID x CRAFT table is cached, not the filtered orders
+    df = load_and_filter_orders(years, months, season)
+    # only crafts in the palette are charted; the rest would be grey noise
+    df = df[df["CRAFT"].isin(CRAFT_COLORS)]
+    return (
+        df.groupby(["FAC_ID", "CRAFT"], observed=True, sort=False)
+          .size()
+          .unstack(fill_value=0)
+          .sort_index(axis=1)  # crafts back in palette (category) order
+          .astype(np.uint32)
+    )
 
 
 # Pie‐Chart Renderer 
 
-def make_pie_datauri(counts):
-    fig, ax = plt.subplots(figsize=(2, 2))
+def pie_svg(counts, colors):
+    r, c = 48, 50
+    # slices run counter-clockwise from 12 o'clock, like plt.pie(startangle=90)
+    frac   = counts / counts.sum()
+    angles = np.pi / 2 + 2 * np.pi * np.concatenate(([0.0], np.cumsum(frac)))
+    xs = c + r * np.cos(angles)
+    ys = c - r * np.sin(angles)
+
+    parts = []
+    if len(counts) == 1:
+        parts.append(f"<circle cx='{c}' cy='{c}' r='{r}' fill='{colors[0]}'/>")
+    else:
+        for i, col in enumerate(colors):
+            large = int(frac[i] > 0.5)
+            parts.append(
+                f"<path d='M{c},{c} L{xs[i]:.2f},{ys[i]:.2f} "
+                f"A{r},{r} 0 {large} 0 {xs[i + 1]:.2f},{ys[i + 1]:.2f} Z' "
+                f"fill='{col}' stroke='white'/>"
+            )
 
-    # pick colors in the same order as counts.index
-    colors = [CRAFT_COLORS.get(c, "#CCCCCC") for c in counts.index]
+    mid = (angles[:-1] + angles[1:]) / 2
+    for p, a in zip(frac * 100, mid):
+        if p >= PCT_ON_SLICE:
+            parts.append(
+                f"<text x='{c + 0.6 * r * np.cos(a):.2f}' "
+                f"y='{c - 0.6 * r * np.sin(a):.2f}' font-size='10' "
+                f"text-anchor='middle' dominant-baseline='central'>{p:.0f}%</text>"
+            )
 
-    autopct = lambda p: f"{p:.0f}%" if p >= PCT_ON_SLICE else ""
-    ax.pie(
-        counts,
-        labels=None,
-        autopct=autopct,
-        startangle=90,
-        colors=colors,
-        wedgeprops={"edgecolor": "white"},
+    return (
+        "<svg width='120' height='120' viewBox='0 0 100 100'>"
+        + "".join(parts)
+        + "</svg>"
     )
-    ax.axis("equal")
 
-    buf = BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight", transparent=True)
-    plt.close(fig)
-    buf.seek(0)
-    data = base64.b64encode(buf.read()).decode()
-    return f"data:image/png;base64,{data}"
+
+@st.cache_data(max_entries=512)
+def _pie_cached(sig: tuple[tuple[str, int], ...]) -> str:
+    colors, pct = zip(*sig)
+    return pie_svg(np.array(pct), colors)
+
+
+def make_pie_svg(colors, pct):
+    # key on whole-percent (color, pct) pairs: near-identical mixes share a pie
+    pct_int = np.rint(pct).astype(int)
+    keep = pct_int > 0
+    return _pie_cached(tuple(zip(colors[keep].tolist(), pct_int[keep].tolist())))
 
 
 #  Tooltip HTML 
 
-def build_tooltip_html(row):
-    name = row["Sheet3__Common_Name"]
-    if name in grouped.index:
-        raw    = grouped.loc[name]
-        counts = raw[raw > 0]
-        pct    = counts.div(counts.sum()) * 100
-        uri    = make_pie_datauri(counts)
-
-        lines = []
-        for craft, p in zip(counts.index, pct):
-            col = CRAFT_COLORS.get(craft, "#CCCCCC")
-            swatch = (
-                f"<span style='display:inline-block;"
-                f"width:12px; height:12px; background:{col};"
-                f"margin-right:4px; vertical-align:middle'></span>"
-            )
-            lines.append(f"{swatch}{craft}: {p:.1f}%")
-
-        legend = "<br>".join(lines)
-
-        return (
-            "<div style='text-align:center;'>"
-              f"<strong>{name}</strong><br>"
-              f"<img src='{uri}' width='120px'><br>"
-              "<div style='text-align:left; font-size:0.9em; "
-                         "column-count:2; column-gap:12px; "
-                         "margin-top:4px; overscroll-behavior:contain;'>"
-                f"{legend}"
-              "</div>"
-            "</div>"
-        )
-    else:
-        return (
-            "<div style='text-align:center;'>"
-              f"<strong>{name}</strong><br>"
-              "No work-order data"
-            "</div>"
-        )
+# static wrapper, shipped once with the deck; pydeck fills in the {column}s
+TOOLTIP_HTML = (
+    "<div style='text-align:center;'>"
+      "<strong>{Sheet3__Common_Name}</strong><br>"
+      "{pie_html}{legend_html}"
+    "</div>"
+)
+NO_DATA_LEGEND = "No work-order data"
+
+def build_tooltip_parts(labels, pct, colors):
+    svg = make_pie_svg(colors, pct)
+    legend = "<br>".join([f"{lab}{p:.1f}%" for lab, p in zip(labels, pct)])
+
+    pie_html = f"{svg}<br>"
+    legend_html = (
+        "<div style='text-align:left; font-size:0.9em; "
+                   "column-count:2; column-gap:12px; "
+                   "margin-top:4px; overscroll-behavior:contain;'>"
+          f"{legend}"
+        "</div>"
+    )
+    return pie_html, legend_html
 
-gdf["tooltip_html"] = gdf.apply(build_tooltip_html, axis=1)
+@st.cache_data
+def build_tooltips(years, months, season):
+    grouped = compute_grouped(years, months, season)
+    # one fragment per FAC_ID that has a footprint; join fans it out to the
+    # polygons, and unmatched ids would only be thrown away
+    grouped = grouped[grouped.index.isin(load_buildings()["Sheet3__Common_Name"])]
+
+    mat = grouped.to_numpy()
+    tot = mat.sum(axis=1, keepdims=True)
+    # whole matrix in one pass; all-zero rows give 0% rather than NaN
+    pct = np.where(tot > 0, mat / np.maximum(tot, 1) * 100, 0).round(1)
+
+    # palette position per column
+    pal    = pd.Index(CRAFT_CATS).get_indexer(grouped.columns)
+    colors = COLOR_ARR[pal]
+    # "<swatch>CRAFT: " prefix per column, so buildings only format a number
+    labels = SWATCH_HTML[pal] + grouped.columns.to_numpy(dtype=object) + ": "
+    # palette position of each building's most frequent craft
+    dominant = pal[mat.argmax(axis=1)]
+
+    rows = {
+        name: (*build_tooltip_parts(labels[nz], row_pct[nz], colors[nz]), dom)
+        for name, row, row_pct, dom in zip(grouped.index, mat, pct, dominant)
+        if (nz := row > 0).any()
+    }
+    return pd.DataFrame.from_dict(
+        rows, orient="index", columns=["pie_html", "legend_html", "fill_idx"]
+    )
+
+def layer_frame(years, months, season):
+    # footprints plus the per-filter tooltip and fill columns, built fresh
+    # so the shared load_buildings() frame is never touched
+    gdf = load_buildings()
+    if compute_grouped(years, months, season).empty:
+        # nothing survived the filters: every building is "No work-order data"
+        gdf = gdf.assign(pie_html="", legend_html=NO_DATA_LEGEND)
+        fill_idx = np.full(len(gdf), NO_DATA_FILL)
+    else:
+        gdf = gdf.join(build_tooltips(years, months, season),
+                       on="Sheet3__Common_Name")
+        gdf["pie_html"]    = gdf["pie_html"].fillna("")
+        gdf["legend_html"] = gdf["legend_html"].fillna(NO_DATA_LEGEND)
+        fill_idx = gdf.pop("fill_idx").fillna(NO_DATA_FILL).astype(int).to_numpy()
+
+    # shade each building by its dominant craft; deck.gl does the colouring
+    gdf["fill_color"] = FILL_RGBA[fill_idx].tolist()
+    return gdf
 
 
 # Render Map 
@@ -192,27 +370,40 @@ view_state = pdk.ViewState(
     pitch=0
 )
 
-layer = pdk.Layer(
-    "GeoJsonLayer",
-    data=gdf,
-    pickable=True,
-    stroked=True,
-    filled=True,
-    extruded=False,
-    get_fill_color=[50, 100, 200, 80],
-    get_line_color=[255, 255, 255, 200],
-)
+# everything the layer and TOOLTIP_HTML read; nothing else goes to the browser
+LAYER_COLUMNS = [
+    "geometry", "Sheet3__Common_Name", "pie_html", "legend_html", "fill_color",
+]
+
+@st.cache_resource(max_entries=32)
+def build_deck(years, months, season):
+    # whole filter -> payload pipeline, so a repeated selection is a lookup
+    layer = pdk.Layer(
+        "GeoJsonLayer",
+        data=layer_frame(years, months, season)[LAYER_COLUMNS],
+        pickable=True,
+        stroked=True,
+        filled=True,
+        extruded=False,
+        get_fill_color="fill_color",
+        get_line_color=[255, 255, 255, 200],
+    )
 
-deck = pdk.Deck(
-    layers=[layer],
-    initial_view_state=view_state,
-    tooltip={
-        "html": "{tooltip_html}",
-        "style": {"backgroundColor": "rgba(0,0,0,0.8)", "color": "white"}
-    }
-)
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=view_state,
+        tooltip={
+            "html": TOOLTIP_HTML,
+            "style": {"backgroundColor": "rgba(0,0,0,0.8)", "color": "white"}
+        }
+    )
 
-st.write("Hover over a building to see its pie-chart and legend.")
+deck = build_deck(selected_years, selected_months, season_months)
+
+st.write(
+    "Buildings are shaded by their most common craft. "
+    "Hover over a building to see its pie-chart and legend."
+)
 st.pydeck_chart(deck, use_container_width=True, height=600)
 
 